@@ -6,12 +6,42 @@ Author: CY THAM
 Version: 1.0.0
 """
 
+import functools
+import json
 import math
+import threading
+import weakref
 import numpy as np
 import pandas as pd
+from pandas.api.types import is_bool_dtype
 
 import plotly.graph_objects as go
 
+SV_CLASSES = ("NIL", "DEL", "INV", "INS", "BND", "DUP", "UKN")
+COLOR_DICT = {
+    "DEL": "#4daf4a",
+    "INV": "#377eb8",
+    "INS": "#e41a1c",
+    "BND": "#984ea3",
+    "DUP": "#ff7f00",
+    "UKN": "#000000",
+    "NIL": "#d1d9e0",
+}
+# VariantBreak stores SV class k (in SV_CLASSES order) as the centre of the
+# k-th of this many equal bands between 0 and 1; this is fixed by its output
+# format, not by the number of classes plotted here
+VARIANTBREAK_BANDS = 7
+
+# SV classes are plotted as codes 0, 1, ..., one colorscale band per code
+TICKVALS = tuple(range(len(SV_CLASSES)))
+MARKERS = np.arange(len(SV_CLASSES) + 1) - 0.5
+
+# Positions of filtered rows by id of the input dataframe, then by filter
+# arguments
+_FILTER_CACHE = {}
+_FILTER_CACHE_SIZE = 8
+_FILTER_CACHE_LOCK = threading.Lock()
+
 
 def VariantMap(
         dataframe,
@@ -28,6 +58,7 @@ def VariantMap(
         rangeslider=True,
         height=500,
         width=600,
+        source=None,
 ):
     """Returns a Dash Bio VariantMap figure.
 
@@ -49,14 +80,17 @@ Keyword arguments:
     'Gene_id', 'Transcript_id', 'Gene_name', 'Gene_type' and 'Gene_feature'
     for GTF/GFF. For BED annotation files, the key will be their 4th column
     label if present, or else they will be 'BED1', 'BED2' and so on. Please
-    refer to the legend.txt file.
+    refer to the legend.txt file. Annotations are matched exactly against
+    the '/'-separated annotations of an SV, or a '/'-joined run of them
+    (e.g. 'protein_coding/lncRNA').
 - filter_sample (list; optional): The list of default sample names
     (e.g. 'S1', 'S2') to be removed from the plot together with the SVs they
     possessed. For example, a non-diseased sample can be selected by this
     argument to omit non-diseased associated SVs in the remaining diseased sample.
 - filter_file (list; optional): The list of default filter names
     (e.g. 'Filter1', 'Filter2') for filter activation. SVs that overlapped with
-    the respective filter BED files will be excluded from the plot.
+    the respective filter BED files will be excluded from the plot. Filter
+    columns may hold '1' for overlapping SVs, or be boolean.
 - sample_order (list, optional): The list of default sample names
     (e.g. 'S1', 'S2') with the order intended for plotting. Samples can also be
     omitted from the plot using this argument.
@@ -73,6 +107,18 @@ Keyword arguments:
 - rangeslider (bool; default True): Whether or not to show the range slider.
 - height (number; default 500): The height of the graph, in px.
 - width (number; default 700): The width of the graph, in px.
+- source (string; optional): Set to 'arrow' to pass the path of a Feather
+    (Arrow IPC) file written by VariantBreak as `dataframe`. String columns are
+    loaded as Arrow-backed (e.g. dictionary-encoded) columns and the metadata
+    is read from the 'metadata' key of the file's schema metadata. Requires
+    pyarrow and pandas >= 2.0.
+
+The result of the annotation and filter arguments is cached per dataframe
+object, so that switching between batches of the same dataframe only redoes
+the plotting (source='arrow' loads a new dataframe on every call). Changing
+the rows (e.g. sorting or dropping them) or columns of a dataframe in place
+invalidates the cache; if values of a dataframe are modified in place after
+plotting, call VariantMap.clear_cache() before plotting it again.
 
 
 Usage example:
@@ -93,8 +139,16 @@ df.metadata = metadata
 # Plot VariantMap
 fig = dash_bio.VariantMap(df)
 
+# Or plot VariantMap straight from a Feather file
+fig = dash_bio.VariantMap("/path/to/sample.feather", source="arrow")
+
     """
 
+    if source == "arrow":
+        dataframe = _from_arrow(dataframe)
+    elif source is not None:
+        raise ValueError(f"Unknown source '{source}', expected 'arrow'")
+
     # Get labels of samples to display
     if sample_order is None:
         # All samples to be displayed and default order
@@ -102,30 +156,18 @@ fig = dash_bio.VariantMap(df)
     else:
         samples = sample_order
 
-    sv_classes = ["NIL", "DEL", "INV", "INS", "BND", "DUP", "UKN"]
-
-    color_dict = {
-        "DEL": "#4daf4a",
-        "INV": "#377eb8",
-        "INS": "#e41a1c",
-        "BND": "#984ea3",
-        "DUP": "#ff7f00",
-        "UKN": "#000000",
-        "NIL": "#d1d9e0",
-    }
-
     colors = []
 
     # Generate color list for colorbar
     if color_list is None:
-        for _class in sv_classes:
-            colors.append(color_dict[_class])
+        for _class in SV_CLASSES:
+            colors.append(COLOR_DICT[_class])
     else:
-        for _class in sv_classes:
+        for _class in SV_CLASSES:
             try:
                 colors.append(color_list[_class])
             except KeyError:
-                colors.append(color_dict[_class])
+                colors.append(COLOR_DICT[_class])
 
     vm = _VariantMap(
         dataframe,
@@ -147,6 +189,129 @@ fig = dash_bio.VariantMap(df)
     return vm.figure()
 
 
+def _from_arrow(path):
+    """
+    :param path: path to a Feather (Arrow IPC) file written by VariantBreak
+    :return: VariantBreak dataframe with Arrow-backed columns and metadata
+    """
+    if not hasattr(pd, "ArrowDtype"):
+        raise ImportError(
+            f"source='arrow' requires pandas >= 2.0, found pandas {pd.__version__}"
+        )
+
+    # pyarrow is optional and only needed for this source
+    from pyarrow import feather  # pylint: disable=import-outside-toplevel
+
+    table = feather.read_table(path)
+    metadata = (table.schema.metadata or {}).get(b"metadata")
+    if metadata is None:
+        raise ValueError(
+            f"No VariantBreak metadata found in '{path}': expected a 'metadata' "
+            "key in the Feather schema metadata"
+        )
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    # Add metadata to dataframe
+    df.metadata = ""
+    df.metadata = json.loads(metadata)
+
+    return df
+
+
+def _clear_cache():
+    """Clears the filtered rows cached by VariantMap."""
+    _FILTER_CACHE.clear()
+
+
+VariantMap.clear_cache = _clear_cache
+
+
+def _filter_rows(df, annotation, filter_sample, filter_file):
+    """
+    :param df: VariantBreak dataframe
+    :param annotation: dict of annotations to keep, see VariantMap
+    :param filter_sample: list of samples whose SVs are removed
+    :param filter_file: list of filters whose overlapping SVs are removed
+    :return: positions of the rows passing all filters, or None to keep
+        all rows, cached per dataframe and arguments
+    """
+    key = (
+        tuple((k, tuple(v)) for k, v in sorted((annotation or {}).items()) if v),
+        tuple(filter_sample or ()),
+        tuple(filter_file or ()),
+    )
+
+    # Nothing to filter
+    if not any(key):
+        return None
+
+    # Guard against columns added or removed in place since the last call
+    key += (tuple(df.columns),)
+
+    df_id = id(df)
+    with _FILTER_CACHE_LOCK:
+        cache = _FILTER_CACHE.get(df_id)
+        if cache is None:
+            cache = _FILTER_CACHE[df_id] = {}
+            # Drop cached results once the dataframe is garbage collected
+            weakref.finalize(df, _FILTER_CACHE.pop, df_id, None)
+        entry = cache.get(key)
+
+    # Reordering, dropping or relabeling rows in place replaces the index, so
+    # positions cached for another index object are stale
+    if entry is not None and entry[0] is df.index:
+        return entry[1]
+
+    rows = _apply_filters(df, annotation, filter_sample, filter_file)
+    with _FILTER_CACHE_LOCK:
+        if key not in cache and len(cache) >= _FILTER_CACHE_SIZE:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = (df.index, rows)
+
+    return rows
+
+
+def _apply_filters(df, annotation, filter_sample, filter_file):
+    """
+    :param df: VariantBreak dataframe
+    :param annotation: dict of annotations to keep, see VariantMap
+    :param filter_sample: list of samples whose SVs are removed
+    :param filter_file: list of filters whose overlapping SVs are removed
+    :return: positions of the rows passing all filters, or None to keep
+        all rows
+    """
+    # Collect one mask per filter and combine them once
+    masks = []
+
+    # Keep SVs that match the gene names or SV indexes, and every other
+    # annotation
+    if annotation:
+        gene_names = annotation.get("Gene_name")
+        index_list = annotation.get("index_list")
+        if gene_names or index_list:
+            mask = np.zeros(len(df), dtype=bool)
+            if gene_names:
+                mask |= _annotation_mask(df["Gene_name"], gene_names)
+            if index_list:
+                mask |= df.index.isin(index_list)
+            masks.append(mask)
+        for _key, _annotations in annotation.items():
+            if _annotations and _key not in ["Gene_name", "index_list"]:
+                masks.append(_annotation_mask(df[_key], _annotations))
+
+    # Remove SVs present in filtered samples
+    if filter_sample:
+        masks.append((df[filter_sample].to_numpy() == 0.0).all(axis=1))
+
+    # Remove SVs overlapping filter files
+    if filter_file:
+        masks.append(~_filter_hits(df[filter_file]).any(axis=1))
+
+    if not masks:
+        return None
+    return np.flatnonzero(np.logical_and.reduce(masks))
+
+
 class _VariantMap:
 
     """Returns a Dash Bio VariantMap object.
@@ -154,6 +319,10 @@ class _VariantMap:
 Methods:
 
 - figure: Returns a VariantMap plotly graph object.
+
+Attributes z (SV class codes) and hover (hover-text) hold one row per sample
+in plotting order. They are read-only (hover is a view of the batch array)
+and must not be modified in place.
     """
 
     def __init__(
@@ -180,112 +349,59 @@ Methods:
         self.width = width
 
         # Generating discrete colorscale
-        markers = [0.0, 0.2, 0.4, 0.6, 0.8, 1.0, 1.2, 1.4]
-        self.dcolorsc = discrete_colorscale(markers, colors)
-        self.tickvals = [0.071, 0.214, 0.357, 0.500, 0.643, 0.786, 0.929]
-        self.ticktext = ["NIL", "DEL", "INV", "INS", "BND", "DUP", "UKN"]
-
-        # Subset dataframe by gene name and SV index
-        if annotation:
-            if "Gene_name" in annotation and "index_list" in annotation:
-                if annotation["Gene_name"] and annotation["index_list"]:
-                    df_genes = df[
-                        df["Gene_name"].str.contains(
-                            "|".join([x + ";" for x in annotation["Gene_name"]])
-                        )
-                    ].copy()
-                    df_indexes = df.loc[annotation["index_list"], :].copy()
-                    df = pd.concat([df_genes, df_indexes])
-                else:
-                    if annotation["Gene_name"]:
-                        df = df[
-                            df["Gene_name"].str.contains(
-                                "|".join([x + ";" for x in annotation["Gene_name"]])
-                            )
-                        ]
-                    if annotation["index_list"]:
-                        df = df.loc[annotation["index_list"], :]
-            else:
-                if "Gene_name" in annotation:
-                    if annotation["Gene_name"]:
-                        df = df[
-                            df["Gene_name"].str.contains(
-                                "|".join([x + ";" for x in annotation["Gene_name"]])
-                            )
-                        ]
-                if "index_list" in annotation:
-                    if annotation["index_list"]:
-                        df = df.loc[annotation["index_list"], :]
-
-        # Subset dataframe by annotation
-        if annotation:
-            for _key in annotation:
-                if annotation[_key]:
-                    if _key in ["Gene_name", "index_list"]:
-                        pass
-                    else:
-                        df = df[df[_key].str.contains("|".join(annotation[_key]))]
-
-        # Subset dataframe by sample filter
-        if filter_sample:
-            for sample in filter_sample:
-                df = df[df[sample] == 0.0]
-
-        # Subtset dataframe by filter file
-        if filter_file:
-            for _filter in filter_file:
-                df = df[df[_filter] != "1"]
-
-        # Make a copy of dataframe
-        df_new = df.copy()
+        self.dcolorsc = [list(x) for x in _cached_colorscale(tuple(colors))]
+        self.tickvals = list(TICKVALS)
+        self.ticktext = list(SV_CLASSES)
+
+        # Get positions of rows passing the annotation and filters, reusing
+        # the result of earlier calls with the same dataframe and arguments
+        rows = _filter_rows(df, annotation, filter_sample, filter_file)
+        n_rows = len(df) if rows is None else len(rows)
 
         # Get actual sample order list
-        sample_order = [x for x in samples if x in df_new.columns]
+        sample_order = [x for x in samples if x in df.columns]
 
         # Calculate number of divisions
-        div = math.ceil(len(df_new) / entries_per_batch) + 0.001
+        div = max(math.ceil(n_rows / entries_per_batch), 1)
 
         # Calculate actual batch size
-        self.batch_size = math.ceil(len(df_new) / div)
-
-        # Add batch number to dataframe
-        df_new.loc[:, "Group"] = (
-            np.divmod(np.arange(len(df_new)), self.batch_size)[0] + 1
-        )
-
-        # Subset dataframe by batch label
-        df_new = df_new[df_new["Group"].isin([int(batch_no_for_display)])]
+        self.batch_size = -(-n_rows // div)
 
-        # Transpose dataframe
-        df_new = df_new.T
+        # Get rows of the batch to display
+        start = (int(batch_no_for_display) - 1) * self.batch_size
+        batch = slice(start, start + self.batch_size)
+        if rows is not None:
+            batch = rows[batch]
 
-        # Subset sample rows from dataframe and convert to list of lists
-        z = df_new.loc[sample_order, :].values.tolist()
-
-        # Reverse list
-        self.z = z[::-1]
-
-        # Subset hover-text row from dataframe and convert to list of lists
+        # Look up positions of sample and hover-text columns in one pass, so
+        # only those columns of the batch rows are ever copied
         hover_list = ["Hover_" + x for x in sample_order]
-        hover_text = df_new.loc[hover_list, :].values.tolist()
-
-        # Reverse list
-        self.hover = hover_text[::-1]
+        positions = df.columns.get_indexer(sample_order + hover_list)
+        if (positions < 0).any():
+            missing = [x for x in hover_list if x not in df.columns]
+            raise KeyError(f"Hover-text columns {missing} not found in dataframe")
+        sample_pos = positions[:len(sample_order)]
+        hover_pos = positions[len(sample_order):]
+
+        # Subset sample columns and convert them to SV class codes with one
+        # row per sample in reverse order. Plotly >= 6 sends a C-contiguous
+        # numeric array to plotly.js as a base64 typed array ('u1') rather
+        # than as a JSON list of numbers.
+        self.z = _class_codes(df.iloc[batch, sample_pos].to_numpy(dtype=float))
+        self.z.flags.writeable = False
+
+        # Subset hover-text columns, one row per sample in reverse order
+        self.hover = df.iloc[batch, hover_pos].to_numpy().T[::-1]
+        self.hover.flags.writeable = False
 
         # Change sample labels if provided
-        if sample_names is None:
-            names = sample_order
+        if sample_names:
+            names = [sample_names.get(x, x) for x in sample_order]
         else:
-            names = []
-            for name in sample_order:
-                try:
-                    names.append(sample_names[name])
-                except KeyError:
-                    names.append(name)
+            names = list(sample_order)
 
         # Reverse sample name list
-        names.reverse()
-        self.names = names
+        self.names = names[::-1]
 
     def figure(self):
         """
@@ -305,8 +421,8 @@ Methods:
                 ticktext=self.ticktext,
                 tickfont=dict(family="Open Sans", size=14, color="#ffffff"),
             ),
-            zmin=0.0,
-            zmax=1.0,
+            zmin=MARKERS[0],
+            zmax=MARKERS[-1],
             hovertext=self.hover,
             hoverinfo="text",
             xgap=2,
@@ -353,13 +469,77 @@ def discrete_colorscale(markers, colors):
     :param colors:
     :return: color scale
     """
-    markers = sorted(markers)
-    norm_mark = [
-        round((v - markers[0]) / (markers[-1] - markers[0]), 3) for v in markers
-    ]
-    dcolorscale = []
-    for k in enumerate(colors):
-        dcolorscale.extend(
-            [[norm_mark[k[0]], colors[k[0]]], [norm_mark[k[0] + 1], colors[k[0]]]]
-        )
-    return dcolorscale
+    markers = np.sort(np.asarray(markers, dtype=float))
+    norm_mark = np.round((markers - markers[0]) / (markers[-1] - markers[0]), 3)
+
+    # Each color spans from its own marker to the next one
+    stops = np.empty(2 * len(colors))
+    stops[0::2] = norm_mark[:len(colors)]
+    stops[1::2] = norm_mark[1:len(colors) + 1]
+    colors = np.repeat(colors, 2)
+    return [[stop, color] for stop, color in zip(stops.tolist(), colors.tolist())]
+
+
+def _class_codes(values):
+    """
+    :param values: 2D array of VariantBreak SV class values (bin centres
+        between 0 and 1), one column per sample
+    :return: C-contiguous array of SV class codes, one row per sample in
+        reverse order; uint8, or float with NaN kept if values are missing
+    """
+    codes = values * VARIANTBREAK_BANDS
+    np.floor(codes, out=codes)
+    np.clip(codes, 0, VARIANTBREAK_BANDS - 1, out=codes)
+
+    # Missing values are plotted as gaps, which needs a float array
+    if np.isnan(codes).any():
+        return np.ascontiguousarray(codes.T[::-1])
+    return np.ascontiguousarray(codes.T[::-1], dtype=np.uint8)
+
+
+def _filter_hits(columns):
+    """
+    :param columns: filter columns of a VariantBreak dataframe, each either
+        boolean or holding '1' for SVs overlapping the filter
+    :return: 2D boolean array, True where an SV overlaps a filter
+    """
+    return np.column_stack([
+        column.fillna(False).to_numpy(dtype=bool)
+        if is_bool_dtype(column.dtype) else column.to_numpy() == "1"
+        for _, column in columns.items()
+    ])
+
+
+def _annotation_mask(column, annotations):
+    """
+    :param column: annotation column of a VariantBreak dataframe, where each
+        entry holds '/'-separated annotations (gene names end with ';')
+    :param annotations: list of annotations to keep
+    :return: boolean array, True for entries having any of the annotations
+    """
+    annotations = frozenset(annotations)
+
+    # Test each distinct entry once: as a whole (e.g. 'protein_coding/lncRNA')
+    # and by its '/'-separated annotations; missing entries (code -1) never match
+    codes, entries = pd.factorize(column)
+    hits = np.fromiter(
+        (
+            entry in annotations
+            or not annotations.isdisjoint(
+                x.strip().rstrip(";") for x in entry.split("/")
+            )
+            for entry in entries
+        ),
+        dtype=bool,
+        count=len(entries),
+    )
+    return np.append(hits, False)[codes]
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_colorscale(colors):
+    """
+    :param colors: tuple of colors, one per SV class
+    :return: discrete color scale over MARKERS, as a tuple of tuples
+    """
+    return tuple(tuple(x) for x in discrete_colorscale(MARKERS, colors))
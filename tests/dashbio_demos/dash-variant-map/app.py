@@ -32,6 +32,10 @@ except ModuleNotFoundError:
 
 DATAPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
+# Last dataframe loaded from memory. It is reused while the stored data is
+# unchanged, so that VariantMap can reuse its filtered rows across slider moves.
+_LOADED = {}
+
 
 def description():
     return "Variant Map visualizes cohort structural variants in a heatmap."
@@ -310,6 +314,23 @@ def layout():
     )
 
 
+def load_dataframe(data):
+    """Returns the dataframe in memory, parsing it only when it has changed."""
+    # Read the stored JSON and dataframe as one pair, so that concurrent
+    # callbacks never see the JSON of one upload with the dataframe of another
+    entry = _LOADED.get("entry")
+    if entry is None or entry[0] != data["df"]:
+        df = pd.read_json(data["df"], orient="split")
+
+        # Add metadata to dataframe
+        df.metadata = ""
+        df.metadata = data["metadata"]
+
+        entry = (data["df"], df)
+        _LOADED["entry"] = entry
+    return entry[1]
+
+
 def callbacks(app):
 
     # Callback upon uploading of dataset
@@ -760,11 +781,7 @@ def callbacks(app):
         error_msg = None
 
         # Load dataframe from memory
-        df = pd.read_json(data["df"], orient="split")
-
-        # Add metadata to dataframe
-        df.metadata = ""
-        df.metadata = data["metadata"]
+        df = load_dataframe(data)
 
         # Rename sample labels
         if label_dict:
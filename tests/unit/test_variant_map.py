@@ -0,0 +1,252 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dash_bio import VariantMap
+
+
+def _make_data():
+    data = pd.DataFrame(
+        {
+            'S1': [0.214, 0.0, 0.5, 0.786],
+            'S2': [0.0, 0.357, 0.5, 0.0],
+            'Gene_name': ['ABC;', 'XABC;', 'ABC;/DEF;', ''],
+            'Gene_type': ['protein_coding', 'lncRNA',
+                          'protein_coding/lncRNA', ''],
+            'Filter1': ['', '1', '', ''],
+            'Hover_S1': ['h1_SV1', '', 'h1_SV3', 'h1_SV4'],
+            'Hover_S2': ['', 'h2_SV2', 'h2_SV3', ''],
+        },
+        index=['SV1', 'SV2', 'SV3', 'SV4']
+    )
+    data.metadata = {'sample_names': ['S1', 'S2']}
+    return data
+
+
+def _hover(fig):
+    return [list(row) for row in fig.data[0].hovertext]
+
+
+def test_default():
+    """Test that all SVs of all samples are plotted."""
+
+    fig = VariantMap(_make_data())
+
+    assert list(fig.data[0].y) == ['S2', 'S1']
+    assert _hover(fig)[1] == ['h1_SV1', '', 'h1_SV3', 'h1_SV4']
+
+
+def test_class_codes():
+    """Test that SV class values are plotted as integer class codes."""
+
+    fig = VariantMap(_make_data())
+
+    assert np.array_equal(fig.data[0].z, [[0, 2, 3, 0], [1, 0, 3, 5]])
+    assert list(fig.data[0].colorbar.tickvals) == [0, 1, 2, 3, 4, 5, 6]
+
+
+def test_missing_values():
+    """Test that missing SV class values are kept as gaps, not as NIL."""
+
+    data = _make_data()
+    data.loc['SV2', 'S1'] = np.nan
+    fig = VariantMap(data)
+
+    assert np.array_equal(
+        fig.data[0].z, [[0, 2, 3, 0], [1, np.nan, 3, 5]], equal_nan=True
+    )
+
+
+def test_gene_name_exact_match():
+    """Test that gene names are matched exactly, not as substrings."""
+
+    fig = VariantMap(
+        _make_data(),
+        annotation={'Gene_name': ['ABC'], 'index_list': []}
+    )
+
+    assert _hover(fig)[1] == ['h1_SV1', 'h1_SV3']
+
+
+def test_annotation_split():
+    """Test that '/'-separated annotations are matched individually."""
+
+    fig = VariantMap(_make_data(), annotation={'Gene_type': ['lncRNA']})
+
+    assert _hover(fig)[0] == ['h2_SV2', 'h2_SV3']
+    assert np.array(fig.data[0].z).shape == (2, 2)
+
+
+def test_annotation_whole_entry():
+    """Test that a whole '/'-joined annotation entry can be matched."""
+
+    fig = VariantMap(
+        _make_data(),
+        annotation={'Gene_type': ['protein_coding/lncRNA', 'lnc']}
+    )
+
+    assert _hover(fig)[1] == ['h1_SV3']
+
+
+def test_gene_name_and_index_union():
+    """Test that SVs matching both gene name and index are kept once."""
+
+    fig = VariantMap(
+        _make_data(),
+        annotation={'Gene_name': ['DEF'], 'index_list': ['SV3', 'SV4']}
+    )
+
+    assert _hover(fig)[1] == ['h1_SV3', 'h1_SV4']
+
+
+def test_index_and_annotation():
+    """Test that SV indexes and other annotations must both match."""
+
+    fig = VariantMap(
+        _make_data(),
+        annotation={'index_list': ['SV2', 'SV3'], 'Gene_type': ['protein_coding']}
+    )
+
+    assert _hover(fig)[1] == ['h1_SV3']
+
+
+def test_filters():
+    """Test that sample and file filters remove the matching SVs."""
+
+    fig = VariantMap(
+        _make_data(),
+        filter_sample=['S2'],
+        filter_file=['Filter1']
+    )
+
+    assert _hover(fig)[1] == ['h1_SV1', 'h1_SV4']
+
+
+def test_filter_cache():
+    """Test that cached filtering follows rows dropped in place."""
+
+    data = _make_data()
+    fig = VariantMap(data, filter_file=['Filter1'], entries_per_batch=2)
+    assert _hover(fig)[1] == ['h1_SV1', 'h1_SV3']
+
+    data.drop('SV1', inplace=True)
+    fig = VariantMap(data, filter_file=['Filter1'], entries_per_batch=2)
+    assert _hover(fig)[1] == ['h1_SV3', 'h1_SV4']
+
+
+def test_filter_cache_sorted_in_place():
+    """Test that cached filtering follows rows sorted in place."""
+
+    data = _make_data()
+    fig = VariantMap(data, filter_file=['Filter1'])
+    assert _hover(fig)[1] == ['h1_SV1', 'h1_SV3', 'h1_SV4']
+
+    data.sort_index(ascending=False, inplace=True)
+    fig = VariantMap(data, filter_file=['Filter1'])
+    assert _hover(fig)[1] == ['h1_SV4', 'h1_SV3', 'h1_SV1']
+
+
+def test_clear_cache():
+    """Test that values modified in place are picked up after clearing."""
+
+    data = _make_data()
+    VariantMap(data, filter_file=['Filter1'])
+
+    data.loc['SV1', 'Filter1'] = '1'
+    VariantMap.clear_cache()
+    fig = VariantMap(data, filter_file=['Filter1'])
+    assert _hover(fig)[1] == ['h1_SV3', 'h1_SV4']
+
+
+def test_batches():
+    """Test that SVs are split into evenly sized, consecutive batches."""
+
+    fig = VariantMap(_make_data(), entries_per_batch=2, batch_no=2)
+
+    assert _hover(fig)[1] == ['h1_SV3', 'h1_SV4']
+
+
+def test_last_batch_has_final_rows():
+    """Test that ceil(rows / entries_per_batch) batches cover every SV."""
+
+    # The former batch size, ceil(rows / (batches + 0.001)), gives 2497 here
+    # and pushes the final SV into a ninth batch beyond the slider's range
+    rows = 19977
+    data = pd.DataFrame(
+        {
+            'S1': [0.214] * rows,
+            'Hover_S1': [f'h_SV{i}' for i in range(rows)],
+        },
+        index=[f'SV{i}' for i in range(rows)]
+    )
+    data.metadata = {'sample_names': ['S1']}
+
+    fig = VariantMap(data, entries_per_batch=2500, batch_no=8)
+
+    hover = _hover(fig)[0]
+    assert len(hover) == rows - 7 * 2498
+    assert hover[-1] == 'h_SV19976'
+
+
+def test_arrow_source(tmp_path):
+    """Test that a Feather file with dictionary-encoded columns can be plotted."""
+
+    pa = pytest.importorskip('pyarrow')
+    feather = pytest.importorskip('pyarrow.feather')
+
+    data = _make_data()
+    table = pa.Table.from_pandas(data)
+    table = pa.Table.from_arrays(
+        [col.dictionary_encode() if col.type in (pa.string(), pa.large_string())
+         else col for col in table.columns],
+        names=table.column_names
+    ).replace_schema_metadata({
+        **table.schema.metadata,
+        b'metadata': json.dumps(data.metadata).encode()
+    })
+    path = str(tmp_path / 'data.feather')
+    feather.write_feather(table, path)
+
+    fig = VariantMap(
+        path,
+        source='arrow',
+        annotation={'Gene_name': ['ABC']},
+        filter_file=['Filter1']
+    )
+
+    assert _hover(fig)[1] == ['h1_SV1', 'h1_SV3']
+
+
+def test_boolean_filter_file():
+    """Test that boolean filter columns are supported."""
+
+    data = _make_data()
+    data['Filter1'] = data['Filter1'] == '1'
+    fig = VariantMap(data, filter_file=['Filter1'])
+
+    assert _hover(fig)[1] == ['h1_SV1', 'h1_SV3', 'h1_SV4']
+
+
+def test_mixed_filter_files():
+    """Test that boolean, nullable boolean and string filters are combined."""
+
+    data = _make_data()
+    data['Filter2'] = [False, False, False, True]
+    data['Filter3'] = pd.array([True, None, False, False], dtype='boolean')
+    fig = VariantMap(data, filter_file=['Filter1', 'Filter2', 'Filter3'])
+
+    assert _hover(fig)[1] == ['h1_SV3']
+
+
+def test_arrow_source_without_metadata(tmp_path):
+    """Test that a Feather file without VariantBreak metadata is rejected."""
+
+    feather = pytest.importorskip('pyarrow.feather')
+
+    path = str(tmp_path / 'data.feather')
+    feather.write_feather(_make_data(), path)
+
+    with pytest.raises(ValueError, match='VariantBreak metadata'):
+        VariantMap(path, source='arrow')